@@ -2,12 +2,16 @@ from prompt import SYSTEM_PROMPT_MANUAL
 import os
 import sys
 import io
+import json
 from dotenv import load_dotenv
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 import asyncio
+import time
+from contextlib import asynccontextmanager
 from google import genai
 from typing import Optional
+from tracing import Tracer
 
 load_dotenv()
 
@@ -29,7 +33,105 @@ def create_tool_descriptions(tools):
     
     return "\n".join(descriptions)
 
-async def run_agent(query: str, max_iter: int = 15, verbose: bool = False, log_callback: Optional[callable] = None):
+def create_server_params():
+    """Parameters for spawning the Playwright MCP server."""
+    return StdioServerParameters(
+        command="npx",
+        args=["-y", "@executeautomation/playwright-mcp-server"],
+        env={**os.environ.copy(), "NODE_ENV": "production"}
+    )
+
+@asynccontextmanager
+async def mcp_session():
+    """Open an initialized MCP session, used for tool calls outside of the agent loop."""
+    # Same as run_agent: the MCP server writes invalid JSON-RPC noise to stderr, keep it out of our output
+    _old_stderr = sys.stderr
+    sys.stderr = io.StringIO()
+    
+    stdio_ctx = None
+    session_ctx = None
+    try:
+        stdio_ctx = stdio_client(create_server_params())
+        read, write = await stdio_ctx.__aenter__()
+
+        session_ctx = ClientSession(read, write)
+        session = await session_ctx.__aenter__()
+        await session.initialize()
+
+        yield session
+    finally:
+        if session_ctx:
+            try: await session_ctx.__aexit__(None, None, None)
+            except: pass
+        if stdio_ctx:
+            try: await stdio_ctx.__aexit__(None, None, None)
+            except: pass
+        sys.stderr = _old_stderr
+
+def build_tool_args(tool, params):
+    """Map positional params from a TOOL_CALL line onto the tool's input schema."""
+    args = {}
+    schema_props = tool.inputSchema.get('properties', {})
+
+    for idx, (param_name, param_info) in enumerate(schema_props.items()):
+        if idx < len(params):
+            val = params[idx]
+            ptype = param_info.get('type', 'string')
+
+            if ptype == 'integer':
+                args[param_name] = int(val)
+            elif ptype == 'number':
+                args[param_name] = float(val)
+            elif ptype == 'boolean':
+                args[param_name] = val.lower() in ['true', '1', 'yes']
+            else:
+                args[param_name] = str(val)
+
+    return args
+
+def tool_result_text(result):
+    """Flatten an MCP tool result into plain text."""
+    if hasattr(result, 'content'):
+        if isinstance(result.content, list):
+            return "\n".join([str(getattr(x, 'text', x)) for x in result.content])
+        return str(result.content)
+    return str(result)
+
+def evaluate_value(rtext: str):
+    """Value of a playwright_evaluate call, without the server's "Executed JavaScript" preamble."""
+    if "Result:" in rtext:
+        rtext = rtext.rsplit("Result:", 1)[1]
+    rtext = rtext.strip()
+    try:
+        return json.loads(rtext)
+    except ValueError:
+        return rtext
+
+def is_failed_result(rtext: str) -> bool:
+    lowered = rtext.lower()
+    return "failed" in lowered or "timeout" in lowered or "error" in lowered
+
+# Tools after which the page URL may differ from the last playwright_navigate, so the checkpoint re-reads it
+URL_CHANGING_TOOLS = {"playwright_click", "playwright_press_key"}
+
+async def current_url(session) -> Optional[str]:
+    try:
+        result = await session.call_tool("playwright_evaluate", arguments={"script": "window.location.href"})
+        value = evaluate_value(tool_result_text(result))
+        return value if isinstance(value, str) and value.startswith("http") else None
+    except Exception:
+        return None
+
+def has_value(rtext: str) -> bool:
+    """True when an evaluate call returned actual data rather than null/undefined."""
+    return bool(rtext) and rtext.strip() not in ['null', 'undefined', '']
+
+async def run_agent(query: str, max_iter: int = 15, verbose: bool = False, log_callback: Optional[callable] = None,
+                    checkpoint_callback: Optional[callable] = None, resume_from: Optional[dict] = None,
+                    tracer: Optional[Tracer] = None, profile=None):
+    # profile: optional profiles.ProfileSession, restores/saves per-site browser state
+    tracer = tracer or Tracer()
+    
     def log(message: str, level: str = "info"):
         if verbose:
             print(message)
@@ -42,13 +144,10 @@ async def run_agent(query: str, max_iter: int = 15, verbose: bool = False, log_c
         sys.stderr = io.StringIO()
     
     try:
+        tracer.begin("run_agent", max_iterations=max_iter)
         log("Starting agent...")
 
-        server_params = StdioServerParameters(
-            command="npx",
-            args=["-y", "@executeautomation/playwright-mcp-server"],
-            env={**os.environ.copy(), "NODE_ENV": "production"}
-        )
+        server_params = create_server_params()
 
         stdio_ctx = None
         session_ctx = None
@@ -58,6 +157,7 @@ async def run_agent(query: str, max_iter: int = 15, verbose: bool = False, log_c
                 _old_stderr = sys.stderr
                 sys.stderr = io.StringIO()
             
+            tracer.begin("setup", "mcp")
             stdio_ctx = stdio_client(server_params)
             read, write = await stdio_ctx.__aenter__()
             
@@ -72,13 +172,57 @@ async def run_agent(query: str, max_iter: int = 15, verbose: bool = False, log_c
             log(f"{len(tools)} tools ready from MCP Server ready")
             
             tools_desc = create_tool_descriptions(tools)
+            tracer.end("setup")
             
             log(f"User's Goal: {query}")
             
             history = []
             execution_log = []
+            page_url = None
+            llm_calls = 0
+            rate_limit_waits = 0
+            start_iter = 0
             
-            for i in range(max_iter):
+            if resume_from:
+                history = resume_from.get("history", [])
+                execution_log = resume_from.get("execution_log", [])
+                page_url = resume_from.get("current_url")
+                llm_calls = resume_from.get("llm_calls", 0)
+                rate_limit_waits = resume_from.get("rate_limit_waits", 0)
+                start_iter = resume_from.get("iteration", 0)
+                log(f"Resuming from checkpoint at iteration {start_iter + 1}")
+                
+                if page_url:
+                    if profile:
+                        with tracer.span("profile_restore", "profile"):
+                            await profile.before_navigate(session, page_url)
+                    nav_start = time.perf_counter()
+                    with tracer.span("tool_call", "tool", tool="playwright_navigate", resumed=True):
+                        result = await session.call_tool("playwright_navigate", arguments={"url": page_url})
+                    rtext = tool_result_text(result)
+                    if is_failed_result(rtext):
+                        log(f"!! Could not restore {page_url}: {rtext[:100]}", "warning")
+                        history.append(f"!! Resumed after restart, re-navigating to {page_url} FAILED")
+                    else:
+                        history.append(f"Resumed after restart on {page_url}")
+                        if profile:
+                            await profile.after_navigate(session, page_url, time.perf_counter() - nav_start)
+            
+            for i in range(start_iter, max_iter):
+                tracer.end("iteration")
+                tracer.begin("iteration", iteration=i + 1)
+                
+                # Checkpoint the state after every completed iteration, the callback must not block
+                if checkpoint_callback and i > start_iter:
+                    checkpoint_callback({
+                        "iteration": i,
+                        "history": history,
+                        "execution_log": execution_log,
+                        "current_url": page_url,
+                        "llm_calls": llm_calls,
+                        "rate_limit_waits": rate_limit_waits
+                    })
+                
                 log(f"\nIteration {i+1}/{max_iter}")
                 
                 if i == 0:
@@ -101,11 +245,13 @@ async def run_agent(query: str, max_iter: int = 15, verbose: bool = False, log_c
                                 Return the NEXT tool call or FINAL_ANSWER."""
                 
                 try:
-                    response = await client.aio.models.generate_content(
-                        model="gemini-2.0-flash-lite",
-                        contents=prompt,
-                        config={"temperature": 0.1}
-                    )
+                    llm_calls += 1
+                    with tracer.span("llm_call", "llm", model="gemini-2.0-flash-lite"):
+                        response = await client.aio.models.generate_content(
+                            model="gemini-2.0-flash-lite",
+                            contents=prompt,
+                            config={"temperature": 0.1}
+                        )
                     text = response.text.strip()
                     log(f"{text}")
                     
@@ -118,12 +264,16 @@ async def run_agent(query: str, max_iter: int = 15, verbose: bool = False, log_c
                     err_str = str(e)
                     if "429" in err_str or "RESOURCE_EXHAUSTED" in err_str:
                         log(f"Rate limit - waiting 10s...", "warning")
-                        await asyncio.sleep(10)
+                        rate_limit_waits += 1
+                        tracer.instant("rate_limited", "llm", error=err_str[:100])
+                        with tracer.span("rate_limit_wait", "wait"):
+                            await asyncio.sleep(10)
                         continue
                     else:
                         log(f"{err_str[:100]}", "error")
                         break
                 
+                tracer.begin("parse")
                 if "TOOL_CALL:" in text:
                     lines = text.split('\n')
                     tool_call_line = None
@@ -133,6 +283,7 @@ async def run_agent(query: str, max_iter: int = 15, verbose: bool = False, log_c
                             break
                     
                     if not tool_call_line:
+                        tracer.end("parse")
                         log("No valid TOOL_CALL", "warning")
                         history.append(f"Invalid response format")
                         continue
@@ -152,6 +303,7 @@ async def run_agent(query: str, max_iter: int = 15, verbose: bool = False, log_c
                         tool_name = parts_raw
                         params = []
                     
+                    tracer.end("parse")
                     log(f"{tool_name} | {params}")
                     
                     tool = next((t for t in tools if t.name == tool_name), None)
@@ -161,49 +313,49 @@ async def run_agent(query: str, max_iter: int = 15, verbose: bool = False, log_c
                         continue
                     
                     try:
-                        args = {}
-                        schema_props = tool.inputSchema.get('properties', {})
-                        
-                        for idx, (param_name, param_info) in enumerate(schema_props.items()):
-                            if idx < len(params):
-                                val = params[idx]
-                                ptype = param_info.get('type', 'string')
-                                
-                                if ptype == 'integer':
-                                    args[param_name] = int(val)
-                                elif ptype == 'number':
-                                    args[param_name] = float(val)
-                                elif ptype == 'boolean':
-                                    args[param_name] = val.lower() in ['true', '1', 'yes']
-                                else:
-                                    args[param_name] = str(val)
+                        args = build_tool_args(tool, params)
+                        execution_log[-1]["tool"] = tool_name
+                        execution_log[-1]["args"] = args
                         
                         log(f"Executing: {args}")
-                        result = await session.call_tool(tool_name, arguments=args)
+                        if profile and tool_name == "playwright_navigate":
+                            with tracer.span("profile_restore", "profile"):
+                                await profile.before_navigate(session, args.get("url", ""))
                         
-                        if hasattr(result, 'content'):
-                            if isinstance(result.content, list):
-                                rtext = "\n".join([str(getattr(x, 'text', x)) for x in result.content])
-                            else:
-                                rtext = str(result.content)
-                        else:
-                            rtext = str(result)
+                        tool_start = time.perf_counter()
+                        with tracer.span("tool_call", "tool", tool=tool_name):
+                            result = await session.call_tool(tool_name, arguments=args)
+                        tool_seconds = time.perf_counter() - tool_start
+                        
+                        rtext = tool_result_text(result)
                         
                         display_text = rtext[:200] if len(rtext) > 200 else rtext
                         
-                        if "failed" in rtext.lower() or "timeout" in rtext.lower() or "error" in rtext.lower():
+                        if is_failed_result(rtext):
                             log(f"!! {display_text}", "warning")
                             history.append(f"!! {tool_name} FAILED: {display_text[:80]}")
                             execution_log[-1]["status"] = "failed"
                             execution_log[-1]["result"] = display_text[:80]
                         else:
                             log(f"{display_text}")
-                            if tool_name == "playwright_evaluate" and rtext and rtext.strip() not in ['null', 'undefined', '']:
+                            if tool_name == "playwright_evaluate" and has_value(rtext):
                                 history.append(f"{tool_name} returned: \"{rtext.strip()[:100]}\"")
                             else:
                                 history.append(f"{tool_name} succeeded")
                             execution_log[-1]["status"] = "success"
                             execution_log[-1]["result"] = display_text[:200]
+                            if tool_name == "playwright_evaluate":
+                                # Unwrapped from the preamble and untruncated, monitors replay this extraction
+                                value = evaluate_value(rtext)
+                                execution_log[-1]["value"] = value[:1000] if isinstance(value, str) else value
+                            
+                            if tool_name == "playwright_navigate":
+                                page_url = args.get("url", page_url)
+                                if profile:
+                                    await profile.after_navigate(session, page_url, tool_seconds)
+                            elif tool_name in URL_CHANGING_TOOLS:
+                                with tracer.span("read_url", "tool"):
+                                    page_url = await current_url(session) or page_url
                         
                     except Exception as e:
                         log(f"{e}", "error")
@@ -217,6 +369,7 @@ async def run_agent(query: str, max_iter: int = 15, verbose: bool = False, log_c
                         if "FINAL_ANSWER:" in line:
                             ans_line = line
                             break
+                    tracer.end("parse")
                     
                     if ans_line:
                         ans = ans_line.replace("FINAL_ANSWER:", "").strip()
@@ -230,6 +383,7 @@ async def run_agent(query: str, max_iter: int = 15, verbose: bool = False, log_c
                             "execution_log": execution_log
                         }
                 else:
+                    tracer.end("parse")
                     log("Invalid format", "warning")
                     history.append(f"Invalid response format")
             
@@ -243,6 +397,15 @@ async def run_agent(query: str, max_iter: int = 15, verbose: bool = False, log_c
             }
         
         finally:
+            tracer.end("setup")
+            tracer.end("iteration")
+            tracer.begin("teardown", "mcp")
+            
+            if profile and session_ctx:
+                with tracer.span("profile_save", "profile"):
+                    try: await profile.save(session)
+                    except: pass
+            
             if not verbose:
                 sys.stderr = io.StringIO()
             
@@ -253,10 +416,13 @@ async def run_agent(query: str, max_iter: int = 15, verbose: bool = False, log_c
                 try: await stdio_ctx.__aexit__(None, None, None)
                 except: pass
             
+            tracer.end("teardown")
+            
             if not verbose:
                 sys.stderr = _old_stderr
     
     finally:
+        tracer.end("run_agent")
         if not verbose:
             sys.stderr = _old_stderr
 
@@ -0,0 +1,64 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Durable per-task checkpoints so running agent loops survive an API restart or worker crash.
+# One JSON file per task; written atomically (tmp file + rename) so a crash mid-write leaves the
+# previous checkpoint intact.
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", ".checkpoints")
+
+# Serialization happens on the caller so the snapshot is consistent, the disk write happens here.
+# A single worker keeps writes and deletes for the same task in order.
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+
+
+def _path(task_id: str) -> str:
+    return os.path.join(CHECKPOINT_DIR, f"{task_id}.json")
+
+
+def _write(task_id: str, payload: str):
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    tmp_path = _path(task_id) + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(payload)
+    os.replace(tmp_path, _path(task_id))
+
+
+def _remove(task_id: str):
+    try:
+        os.remove(_path(task_id))
+    except FileNotFoundError:
+        pass
+
+
+def save_checkpoint(task_id: str, task: Dict, agent_state: Optional[Dict] = None):
+    """Queue a checkpoint write; returns immediately so the agent loop never waits on disk."""
+    payload = json.dumps({
+        "saved_at": datetime.now().isoformat(),
+        "task": task,
+        "agent": agent_state
+    })
+    _writer.submit(_write, task_id, payload)
+
+
+def delete_checkpoint(task_id: str):
+    _writer.submit(_remove, task_id)
+
+
+def load_checkpoints() -> List[Dict]:
+    """All checkpoints left on disk, i.e. tasks that were still running when the process stopped."""
+    if not os.path.isdir(CHECKPOINT_DIR):
+        return []
+
+    checkpoints = []
+    for name in sorted(os.listdir(CHECKPOINT_DIR)):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(CHECKPOINT_DIR, name)) as f:
+                checkpoints.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return checkpoints
@@ -4,9 +4,16 @@ from pydantic import BaseModel, Field, ConfigDict
 from typing import Optional, Dict, List
 import uuid
 from datetime import datetime
+import asyncio
+import time
 import os
 
 from agent import run_agent
+from planner import plan_subgoals, merge_answers
+from tracing import Tracer
+import checkpoint
+import monitor
+import profiles
 
 app = FastAPI(
     title="Playwright Browser Automation API",
@@ -24,6 +31,10 @@ app.add_middleware(
 
 # To store task results, Currently very simple for this POC. In production I might use Redis, or very big data MongoDB
 tasks: Dict[str, dict] = {}
+# Execution timelines, kept apart from `tasks` as they are not part of the JSON task record
+traces: Dict[str, Tracer] = {}
+# Tasks resumed from a checkpoint at startup, so a resumed parent can wait on its resumed children
+resumed_tasks: Dict[str, asyncio.Task] = {}
 
 class AutomationRequest(BaseModel):
     model_config = ConfigDict(
@@ -39,6 +50,42 @@ class AutomationRequest(BaseModel):
     
     goal: str = Field(..., description="The automation task to perform")
     max_iterations: Optional[int] = Field(15, description="Maximum iterations", ge=5, le=30)
+    decompose: bool = Field(False, description="Split multi-site/comparison goals into sub-goals run in parallel, each with its own max_iterations")
+    use_profile: bool = Field(False, description="Restore and save the tenant's persistent per-site browser profile (cookies, localStorage)")
+    tenant: str = Field("default", description="Profile namespace, profiles are never shared across tenants", pattern=r"^[A-Za-z0-9_-]{1,64}$")
+
+class MonitorRequest(BaseModel):
+    model_config = ConfigDict(
+        json_schema_extra={
+            "examples": [
+                {
+                    "goal": "Go to Amazon and find the price of the first laptop",
+                    "interval_seconds": 3600,
+                    "max_iterations": 15
+                }
+            ]
+        }
+    )
+
+    goal: str = Field(..., description="The extraction goal to re-run on a schedule")
+    interval_seconds: int = Field(3600, description="Seconds between runs", ge=60)
+    max_iterations: int = Field(15, description="Maximum iterations when the agent loop is needed", ge=5, le=30)
+
+class MonitorResult(BaseModel):
+    monitor_id: str
+    goal: str
+    interval_seconds: int
+    max_iterations: int
+    created_at: str
+    last_run_at: Optional[str] = None
+    next_run_at: Optional[str] = None
+    plan: Optional[List[Dict]] = None
+    region_hash: Optional[str] = None
+    last_value: Optional[str] = None
+    runs: int
+    agent_runs: int
+    samples: List[Dict]
+    events: List[Dict]
 
 class TaskResponse(BaseModel):
     task_id: str
@@ -57,11 +104,110 @@ class TaskResult(BaseModel):
     history: Optional[List[str]] = None
     execution_log: Optional[List[Dict]] = None
     logs: Optional[List[Dict]] = None
+    parent_task_id: Optional[str] = None
+    child_task_ids: Optional[List[str]] = None
+    parallel_stats: Optional[Dict] = None
 
-async def run_automation_task(task_id: str, goal: str, max_iterations: int):
+def new_task_record(task_id: str, goal: str, **fields) -> dict:
+    task = {
+        "task_id": task_id,
+        "goal": goal,
+        "status": "pending",
+        "result": None,
+        "error": None,
+        "started_at": None,
+        "completed_at": None,
+        "iterations_used": None,
+        "history": None,
+        "execution_log": None,
+        "logs": [],
+        "parent_task_id": None,
+        "child_task_ids": None,
+        "parallel_stats": None
+    }
+    task.update(fields)
+    return task
+
+class TaskDeleted(Exception):
+    """Raised from a task's callbacks once DELETE /task/{task_id} removed it, to stop its agent loop."""
+
+def save_parent_checkpoint(task_id: str, checkpoint_task: dict, child_goals: Dict[str, str]):
+    """The parent's checkpoint holds its sub-goals and the results of children that already finished,
+    since finished children drop their own checkpoint."""
+    if task_id not in tasks:
+        return
+    finished = {}
+    for child_id in child_goals:
+        child = tasks.get(child_id)
+        if child and child["status"] in ("completed", "failed"):
+            finished[child_id] = {k: child[k] for k in ("status", "result", "error", "iterations_used", "completed_at")}
+    checkpoint.save_checkpoint(task_id, checkpoint_task, {"child_goals": child_goals, "children": finished})
+
+async def run_subgoals(task_id: str, goal: str, child_goals: Dict[str, str], max_iterations: int, tracer: Tracer,
+                       checkpoint_task: dict, tenant: Optional[str] = None) -> dict:
+    """Run each sub-goal as its own child task (own browser, own iteration budget) and merge the answers.
+    After a restart, children resumed from their own checkpoint are waited on instead of started again."""
+    if task_id not in tasks:
+        raise TaskDeleted(task_id)
+    child_ids = list(child_goals)
+    for child_id, subgoal in child_goals.items():
+        if child_id not in tasks:
+            tasks[child_id] = new_task_record(child_id, subgoal, parent_task_id=task_id)
+    tasks[task_id]["child_task_ids"] = child_ids
+    save_parent_checkpoint(task_id, checkpoint_task, child_goals)
+    
+    durations = {}
+    
+    async def run_child(child_id: str):
+        child_start = time.perf_counter()
+        if child_id in resumed_tasks:
+            await resumed_tasks[child_id]
+        elif tasks.get(child_id, {}).get("status") == "pending":
+            await run_automation_task(child_id, child_goals[child_id], max_iterations, tenant=tenant)
+        else:
+            return
+        durations[child_id] = time.perf_counter() - child_start
+        save_parent_checkpoint(task_id, checkpoint_task, child_goals)
+    
+    start = time.perf_counter()
+    with tracer.span("subgoals", "api", count=len(child_ids)):
+        await asyncio.gather(*(run_child(child_id) for child_id in child_ids))
+    wall_clock = time.perf_counter() - start
+    if task_id not in tasks:
+        raise TaskDeleted(task_id)
+    
+    children = [tasks[child_id] for child_id in child_ids if child_id in tasks]
+    with tracer.span("merge", "llm"):
+        answer = await merge_answers(goal, children)
+    
+    # Child times are measured while they run side by side, so they include the contention between
+    # browsers and extra 429 waits. Their sum over the wall clock is a concurrency factor, not a speedup
+    # over a real sequential run.
+    summed = sum(durations.values())
+    return {
+        "success": any(c["status"] == "completed" for c in children),
+        "result": answer,
+        "iterations": sum(c["iterations_used"] or 0 for c in children),
+        "history": [f"[{c['status']}] {c['goal']}: {c['result'] or c['error']}" for c in children],
+        "execution_log": [],
+        "parallel_stats": {
+            "subgoals": len(child_ids),
+            "wall_clock_seconds": round(wall_clock, 2),
+            "summed_child_seconds": round(summed, 2),
+            "concurrency": round(summed / wall_clock, 2) if wall_clock > 0 else None
+        }
+    }
+
+async def run_automation_task(task_id: str, goal: str, max_iterations: int, resume_from: Optional[dict] = None,
+                              decompose: bool = False, tenant: Optional[str] = None):
+    # tenant: use that tenant's persistent browser profile, None runs with a fresh browser only
     tasks[task_id]["logs"] = []
+    tracer = traces[task_id] = Tracer(name=f"task {task_id[:8]}")
+    tracer.begin("task", "api", task_id=task_id, goal=goal, resumed=resume_from is not None)
 
     def log_callback(message: str, level: str = "info"):
+        if task_id not in tasks:
+            return
         if "logs" not in tasks[task_id]:
             tasks[task_id]["logs"] = []
         tasks[task_id]["logs"].append({
@@ -70,24 +216,106 @@ async def run_automation_task(task_id: str, goal: str, max_iterations: int):
             "message": message
         })
     
+    def checkpoint_callback(agent_state: dict):
+        # A deleted task must not write its checkpoint back, stop the agent loop instead
+        if task_id not in tasks:
+            raise TaskDeleted(task_id)
+        checkpoint.save_checkpoint(task_id, checkpoint_task, agent_state)
+    
     try:
         tasks[task_id]["status"] = "running"
-        tasks[task_id]["started_at"] = datetime.now().isoformat()
+        tasks[task_id]["started_at"] = tasks[task_id]["started_at"] or datetime.now().isoformat()
+        
+        checkpoint_task = {
+            "task_id": task_id,
+            "goal": goal,
+            "max_iterations": max_iterations,
+            "started_at": tasks[task_id]["started_at"],
+            "parent_task_id": tasks[task_id].get("parent_task_id"),
+            "tenant": tenant,
+            "decompose": decompose
+        }
+        if resume_from is None:
+            checkpoint.save_checkpoint(task_id, checkpoint_task)
         
-        # Run the agent
-        result_data = await run_agent(goal, max_iter=max_iterations, verbose=False, log_callback=log_callback)
+        child_goals = {}
+        if resume_from and "child_goals" in resume_from:
+            child_goals = resume_from["child_goals"]
+        elif decompose:
+            subgoals = []
+            try:
+                with tracer.span("plan", "llm"):
+                    subgoals = await plan_subgoals(goal)
+            except Exception as e:
+                log_callback(f"Planner failed, running as a single goal: {str(e)[:100]}", "warning")
+            log_callback(f"Split into {len(subgoals)} sub-goals: {subgoals}" if subgoals else "Running as a single goal")
+            child_goals = {str(uuid.uuid4()): subgoal for subgoal in subgoals}
         
-        tasks[task_id]["status"] = "completed" if result_data["success"] else "failed"
-        tasks[task_id]["result"] = result_data["result"]
-        tasks[task_id]["iterations_used"] = result_data["iterations"]
-        tasks[task_id]["history"] = result_data["history"]
-        tasks[task_id]["execution_log"] = result_data["execution_log"]
-        tasks[task_id]["completed_at"] = datetime.now().isoformat()
+        if child_goals:
+            result_data = await run_subgoals(task_id, goal, child_goals, max_iterations, tracer, checkpoint_task,
+                                             tenant=tenant)
+        else:
+            # Run the agent
+            result_data = await run_agent(goal, max_iter=max_iterations, verbose=False, log_callback=log_callback,
+                                          checkpoint_callback=checkpoint_callback, resume_from=resume_from,
+                                          tracer=tracer, profile=profiles.ProfileSession(tenant, log_callback) if tenant else None)
+        
+        # The task may have been deleted while the agent was finishing
+        if task_id in tasks:
+            tasks[task_id]["status"] = "completed" if result_data["success"] else "failed"
+            tasks[task_id]["result"] = result_data["result"]
+            tasks[task_id]["iterations_used"] = result_data["iterations"]
+            tasks[task_id]["history"] = result_data["history"]
+            tasks[task_id]["execution_log"] = result_data["execution_log"]
+            tasks[task_id]["parallel_stats"] = result_data.get("parallel_stats")
+            tasks[task_id]["completed_at"] = datetime.now().isoformat()
+        checkpoint.delete_checkpoint(task_id)
         
     except Exception as e:
-        tasks[task_id]["status"] = "failed"
-        tasks[task_id]["error"] = str(e)
-        tasks[task_id]["completed_at"] = datetime.now().isoformat()
+        if task_id in tasks:
+            tasks[task_id]["status"] = "failed"
+            tasks[task_id]["error"] = str(e)
+            tasks[task_id]["completed_at"] = datetime.now().isoformat()
+        checkpoint.delete_checkpoint(task_id)
+    
+    finally:
+        # Not on CancelledError: at shutdown the task is cancelled and its checkpoint has to survive the restart
+        tracer.close()
+        resumed_tasks.pop(task_id, None)
+
+
+@app.on_event("startup")
+async def start_monitor_scheduler():
+    app.state.monitor_scheduler = asyncio.create_task(monitor.scheduler_loop())
+
+# Tasks that were running when the process stopped still have a checkpoint on disk, pick them up from there.
+# A decomposed parent re-attaches to its resumed children through `resumed_tasks` and merges their answers.
+@app.on_event("startup")
+async def resume_checkpointed_tasks():
+    for saved in checkpoint.load_checkpoints():
+        task = saved["task"]
+        task_id = task["task_id"]
+        agent_state = saved.get("agent") or {}
+        child_goals = agent_state.get("child_goals")
+        
+        tasks[task_id] = new_task_record(
+            task_id,
+            task["goal"],
+            started_at=task.get("started_at"),
+            parent_task_id=task.get("parent_task_id"),
+            child_task_ids=list(child_goals) if child_goals else None,
+            iterations_used=agent_state.get("iteration"),
+            history=agent_state.get("history"),
+            execution_log=agent_state.get("execution_log")
+        )
+        # Children that finished before the restart only live on in the parent's checkpoint
+        for child_id, child in agent_state.get("children", {}).items():
+            tasks[child_id] = new_task_record(child_id, child_goals[child_id], parent_task_id=task_id, **child)
+        
+        resumed_tasks[task_id] = asyncio.create_task(
+            run_automation_task(task_id, task["goal"], task["max_iterations"], resume_from=saved.get("agent"),
+                                decompose=task.get("decompose", False), tenant=task.get("tenant"))
+        )
 
 
 @app.get("/")
@@ -100,8 +328,14 @@ async def root():
         "endpoints": {
             "POST /automate": "Submit automation task",
             "GET /task/{task_id}": "Get task status/result",
+            "GET /task/{task_id}/trace": "Get task execution timeline (Chrome Trace / Perfetto JSON)",
             "GET /tasks": "List all tasks",
             "DELETE /task/{task_id}": "Delete a task",
+            "POST /monitors": "Create a recurring monitoring job",
+            "GET /monitors": "List monitoring jobs",
+            "GET /monitors/{monitor_id}": "Get a monitor's time series and change events",
+            "DELETE /monitors/{monitor_id}": "Delete a monitoring job",
+            "GET /profiles/stats": "Per-site profile and cache hit ratios, navigation time with vs without profile",
             "GET /health": "Health check",
             "GET /docs": "API documentation (Swagger UI)",
             "GET /redoc": "API documentation (ReDoc)"
@@ -116,22 +350,11 @@ async def root():
 async def create_automation_task(request: AutomationRequest, background_tasks: BackgroundTasks):
     task_id = str(uuid.uuid4())
     
-    tasks[task_id] = {
-        "task_id": task_id,
-        "goal": request.goal,
-        "status": "pending",
-        "result": None,
-        "error": None,
-        "started_at": None,
-        "completed_at": None,
-        "iterations_used": None,
-        "history": None,
-        "execution_log": None,
-        "logs": []
-    }
+    tasks[task_id] = new_task_record(task_id, request.goal)
     
     # Run in background
-    background_tasks.add_task(run_automation_task, task_id, request.goal, request.max_iterations)
+    background_tasks.add_task(run_automation_task, task_id, request.goal, request.max_iterations, decompose=request.decompose,
+                              tenant=request.tenant if request.use_profile else None)
     
     return TaskResponse(task_id=task_id, status="pending", message=f"Task submitted successfully. Check status at /task/{task_id}")
 
@@ -145,6 +368,15 @@ async def get_task_status(task_id: str):
     return TaskResult(**task)
 
 
+@app.get("/task/{task_id}/trace")
+async def get_task_trace(task_id: str):
+    """Get the task's execution timeline in Chrome Trace Event format, open it in ui.perfetto.dev"""
+    if task_id not in traces:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    
+    return traces[task_id].to_chrome()
+
+
 @app.get("/tasks")
 async def list_tasks(limit: int = 50, status: Optional[str] = None):
     """List all tasks with optional filtering"""
@@ -178,13 +410,60 @@ async def health_check():
 
 @app.delete("/task/{task_id}")
 async def delete_task(task_id: str):
-    """Delete a task"""
+    """Delete a task, and the child tasks of a decomposed parent"""
     if task_id not in tasks:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    del tasks[task_id]
+    # A running task notices at its next checkpoint that it is gone and stops without writing it back
+    for deleted_id in [task_id] + (tasks[task_id]["child_task_ids"] or []):
+        tasks.pop(deleted_id, None)
+        traces.pop(deleted_id, None)
+        checkpoint.delete_checkpoint(deleted_id)
     return {"message": "Task deleted successfully"}
 
+# Monitors run the goal once through the agent, then only replay the recorded extraction on each interval
+@app.post("/monitors", response_model=MonitorResult)
+async def create_monitor(request: MonitorRequest):
+    return MonitorResult(**monitor.create_monitor(request.goal, request.interval_seconds, request.max_iterations))
+
+@app.get("/monitors")
+async def list_monitors(limit: int = 50):
+    """List monitoring jobs without their full time series"""
+    summaries = [
+        {k: v for k, v in m.items() if k not in ("samples", "events", "plan")}
+        for m in monitor.monitors.values()
+    ]
+    return {
+        "monitors": summaries[:limit],
+        "total": len(summaries),
+        "showing": min(len(summaries), limit)
+    }
+
+@app.get("/monitors/{monitor_id}", response_model=MonitorResult)
+async def get_monitor(monitor_id: str):
+    """Get a monitor with its time series and change events"""
+    if monitor_id not in monitor.monitors:
+        raise HTTPException(status_code=404, detail="Monitor not found")
+
+    return MonitorResult(**monitor.monitors[monitor_id])
+
+@app.delete("/monitors/{monitor_id}")
+async def delete_monitor(monitor_id: str):
+    """Delete a monitoring job"""
+    if monitor_id not in monitor.monitors:
+        raise HTTPException(status_code=404, detail="Monitor not found")
+
+    monitor.delete_monitor(monitor_id)
+    return {"message": "Monitor deleted successfully"}
+
+@app.get("/profiles/stats")
+async def profile_stats(tenant: str = "default"):
+    """Per-site profile hit ratio, browser cache hit ratio and navigation time improvement"""
+    return {
+        "tenant": tenant,
+        "sites": profiles.get_stats(tenant)
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
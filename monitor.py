@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from agent import run_agent, mcp_session, tool_result_text, is_failed_result, evaluate_value
+
+# Recurring monitoring jobs. The first run goes through the full agent loop, after that we only
+# replay the recorded steps + extraction and go back to the LLM when the extraction fails or the
+# page region it reads from changes structure.
+monitors: Dict[str, dict] = {}
+
+MONITOR_MAX_CONCURRENT = int(os.getenv("MONITOR_MAX_CONCURRENT", "2"))
+MONITOR_JITTER = 0.1          # +/- fraction of the interval added to every next run
+MONITOR_TICK_SECONDS = 5
+MONITOR_MAX_SAMPLES = 500
+
+_next_run: Dict[str, float] = {}
+_running: Dict[str, asyncio.Task] = {}
+_semaphore: Optional[asyncio.Semaphore] = None
+
+SELECTOR_RE = re.compile(r"""querySelector(?:All)?\(\s*(['"`])(.+?)\1\s*\)""")
+
+# Structural fingerprint of the elements the extraction reads: tag/class skeleton only, no text,
+# so a price change does not count as a structure change but a redesign does.
+REGION_SIGNATURE_JS = """(() => {
+  const skeleton = (el, depth) => {
+    if (!el || depth > 3) return '';
+    const cls = (typeof el.className === 'string' ? el.className : '').trim().split(/\\s+/).sort().join('.');
+    const kids = Array.from(el.children).slice(0, 20).map(c => skeleton(c, depth + 1)).join(',');
+    return el.tagName + (cls ? '.' + cls : '') + '[' + kids + ']';
+  };
+  const selectors = %s;
+  if (!selectors.length) return skeleton(document.body, 2);
+  return selectors.map(s => {
+    let nodes = [];
+    try { nodes = Array.from(document.querySelectorAll(s)).slice(0, 5); } catch (e) { return s + ':invalid'; }
+    return s + ':' + nodes.map(n => skeleton(n, 0)).join('|');
+  }).join('\\n');
+})()"""
+
+
+def normalize_value(value) -> Optional[str]:
+    """Extracted value as comparable text, None when the extraction found nothing."""
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        value = json.dumps(value)
+    value = value.strip()
+    return value[:200] if value and value not in ("null", "undefined") else None
+
+
+def extract_plan(execution_log: List[Dict]) -> Optional[List[Dict]]:
+    """Successful tool steps up to (and including) the last evaluate that returned data."""
+    steps = []
+    plan = None
+    for entry in execution_log or []:
+        if entry.get("status") != "success" or "tool" not in entry:
+            continue
+        steps.append({"tool": entry["tool"], "args": entry.get("args", {})})
+        if entry["tool"] == "playwright_evaluate" and normalize_value(entry.get("value")) is not None:
+            plan = list(steps)
+    return plan
+
+
+def extraction_value(execution_log: List[Dict]) -> Optional[str]:
+    value = None
+    for entry in execution_log or []:
+        if entry.get("status") == "success" and entry.get("tool") == "playwright_evaluate":
+            value = normalize_value(entry.get("value")) or value
+    return value
+
+
+def region_signature_script(extraction_script: str) -> str:
+    selectors = [m.group(2) for m in SELECTOR_RE.finditer(extraction_script or "")]
+    return REGION_SIGNATURE_JS % json.dumps(selectors)
+
+
+async def replay_plan(plan: List[Dict]) -> dict:
+    """Re-run the recorded steps without the LLM and hash the region the extraction reads."""
+    async with mcp_session() as session:
+        rtext = ""
+        for step in plan:
+            result = await session.call_tool(step["tool"], arguments=step["args"])
+            rtext = tool_result_text(result)
+            if is_failed_result(rtext):
+                return {"success": False, "error": f"{step['tool']} failed: {rtext[:100]}"}
+
+        value = normalize_value(evaluate_value(rtext))
+        if value is None:
+            return {"success": False, "error": "Extraction returned no data"}
+
+        extraction_script = plan[-1]["args"].get("script", "")
+        signature = tool_result_text(await session.call_tool(
+            "playwright_evaluate", arguments={"script": region_signature_script(extraction_script)}
+        ))
+        return {
+            "success": True,
+            "value": value,
+            "region_hash": hashlib.sha256(signature.encode()).hexdigest()
+        }
+
+
+def create_monitor(goal: str, interval_seconds: int, max_iterations: int) -> dict:
+    monitor_id = str(uuid.uuid4())
+    monitors[monitor_id] = {
+        "monitor_id": monitor_id,
+        "goal": goal,
+        "interval_seconds": interval_seconds,
+        "max_iterations": max_iterations,
+        "created_at": datetime.now().isoformat(),
+        "last_run_at": None,
+        "next_run_at": None,
+        "plan": None,
+        "region_hash": None,
+        "last_value": None,
+        "runs": 0,
+        "agent_runs": 0,
+        "samples": [],
+        "events": []
+    }
+    # First run is spread over a fraction of the interval so a batch of new monitors don't all fire together
+    _schedule(monitor_id, random.uniform(0, interval_seconds * MONITOR_JITTER))
+    return monitors[monitor_id]
+
+
+def delete_monitor(monitor_id: str):
+    monitors.pop(monitor_id, None)
+    _next_run.pop(monitor_id, None)
+    task = _running.pop(monitor_id, None)
+    if task:
+        task.cancel()
+
+
+def _schedule(monitor_id: str, delay: float):
+    _next_run[monitor_id] = time.time() + delay
+    monitors[monitor_id]["next_run_at"] = datetime.fromtimestamp(_next_run[monitor_id]).isoformat()
+
+
+def _add_event(monitor: dict, event_type: str, **details):
+    monitor["events"].append({"timestamp": datetime.now().isoformat(), "type": event_type, **details})
+    monitor["events"] = monitor["events"][-MONITOR_MAX_SAMPLES:]
+
+
+async def _run_full_agent(monitor: dict) -> dict:
+    result_data = await run_agent(monitor["goal"], max_iter=monitor["max_iterations"], verbose=False)
+    monitor["agent_runs"] += 1
+    monitor["plan"] = extract_plan(result_data["execution_log"]) if result_data["success"] else None
+    # Baseline hash is taken on the next replay, which also proves the plan works without the LLM
+    monitor["region_hash"] = None
+    return {
+        "success": result_data["success"],
+        "value": extraction_value(result_data["execution_log"]) or result_data["result"],
+        "answer": result_data["result"],
+        "iterations": result_data["iterations"],
+        "mode": "agent"
+    }
+
+
+async def run_monitor(monitor_id: str):
+    monitor = monitors[monitor_id]
+    sample = None
+
+    if monitor["plan"]:
+        try:
+            replay = await replay_plan(monitor["plan"])
+        except Exception as e:
+            replay = {"success": False, "error": str(e)[:100]}
+
+        if not replay["success"]:
+            _add_event(monitor, "extraction_failed", error=replay["error"])
+        elif monitor["region_hash"] and replay["region_hash"] != monitor["region_hash"]:
+            _add_event(monitor, "structure_changed", previous=monitor["region_hash"], current=replay["region_hash"])
+        else:
+            monitor["region_hash"] = replay["region_hash"]
+            sample = {"success": True, "value": replay["value"], "answer": None, "iterations": 0, "mode": "replay"}
+
+    if sample is None:
+        sample = await _run_full_agent(monitor)
+
+    monitor["runs"] += 1
+    monitor["last_run_at"] = datetime.now().isoformat()
+
+    changed = sample["success"] and monitor["last_value"] is not None and sample["value"] != monitor["last_value"]
+    if changed:
+        _add_event(monitor, "value_changed", previous=monitor["last_value"], current=sample["value"])
+    if sample["success"]:
+        monitor["last_value"] = sample["value"]
+
+    monitor["samples"].append({"timestamp": monitor["last_run_at"], "changed": changed, **sample})
+    monitor["samples"] = monitor["samples"][-MONITOR_MAX_SAMPLES:]
+
+
+async def _run_and_reschedule(monitor_id: str):
+    try:
+        async with _semaphore:
+            if monitor_id in monitors:
+                await run_monitor(monitor_id)
+    except Exception as e:
+        if monitor_id in monitors:
+            _add_event(monitors[monitor_id], "run_error", error=str(e)[:100])
+    finally:
+        _running.pop(monitor_id, None)
+        if monitor_id in monitors:
+            interval = monitors[monitor_id]["interval_seconds"]
+            _schedule(monitor_id, interval * (1 + random.uniform(-MONITOR_JITTER, MONITOR_JITTER)))
+
+
+async def scheduler_loop():
+    """Fire due monitors; concurrency is capped so overlapping schedules queue instead of piling up."""
+    global _semaphore
+    _semaphore = asyncio.Semaphore(MONITOR_MAX_CONCURRENT)
+    while True:
+        now = time.time()
+        for monitor_id, monitor in list(monitors.items()):
+            if monitor_id not in _running and _next_run.get(monitor_id, now + 1) <= now:
+                _running[monitor_id] = asyncio.create_task(_run_and_reschedule(monitor_id))
+        await asyncio.sleep(MONITOR_TICK_SECONDS)
@@ -0,0 +1,69 @@
+import asyncio
+from typing import Dict, List
+
+from agent import client
+from prompt import SYSTEM_PROMPT_PLANNER, SYSTEM_PROMPT_MERGE
+
+MAX_SUBGOALS = 5
+
+
+async def _generate(prompt: str) -> str:
+    try:
+        response = await client.aio.models.generate_content(
+            model="gemini-2.0-flash-lite",
+            contents=prompt,
+            config={"temperature": 0.1}
+        )
+    except Exception as e:
+        err_str = str(e)
+        if "429" not in err_str and "RESOURCE_EXHAUSTED" not in err_str:
+            raise
+        # Rate limit - same 10s wait as the agent loop, then one retry
+        await asyncio.sleep(10)
+        response = await client.aio.models.generate_content(
+            model="gemini-2.0-flash-lite",
+            contents=prompt,
+            config={"temperature": 0.1}
+        )
+    return response.text.strip()
+
+
+async def plan_subgoals(goal: str) -> List[str]:
+    """Split a goal into independent sub-goals. Fewer than two means: run it as a single agent."""
+    text = await _generate(f"""{SYSTEM_PROMPT_PLANNER}
+
+                               GOAL: {goal}""")
+
+    subgoals = []
+    for line in text.split('\n'):
+        line = line.strip()
+        if line.startswith("SUBGOAL:"):
+            subgoal = line.replace("SUBGOAL:", "").strip()
+            if subgoal and subgoal not in subgoals:
+                subgoals.append(subgoal)
+
+    return subgoals[:MAX_SUBGOALS] if len(subgoals) > 1 else []
+
+
+async def merge_answers(goal: str, partial_results: List[Dict]) -> str:
+    """Combine the children's answers into one FINAL_ANSWER. Falls back to listing them if the LLM can't."""
+    partials = "\n".join(
+        f"- {p['goal']}: {p['result'] if p['status'] == 'completed' else 'FAILED (' + str(p['result'] or p['error']) + ')'}"
+        for p in partial_results
+    )
+    fallback = "; ".join(f"{p['goal']}: {p['result'] or p['error']}" for p in partial_results)
+
+    try:
+        text = await _generate(f"""{SYSTEM_PROMPT_MERGE}
+
+                                   GOAL: {goal}
+
+                                   PARTIAL RESULTS:
+                                   {partials}""")
+    except Exception:
+        return fallback
+
+    for line in text.split('\n'):
+        if "FINAL_ANSWER:" in line:
+            return line.replace("FINAL_ANSWER:", "").strip()
+    return fallback
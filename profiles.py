@@ -0,0 +1,293 @@
+import asyncio
+import fcntl
+import json
+import os
+import re
+import shutil
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from agent import tool_result_text, is_failed_result, evaluate_value
+
+# Persistent per-site browser profiles, isolated per tenant. The Playwright MCP server always starts
+# a fresh, non-persistent browser context, so instead of a Chromium user-data-dir we keep the site's
+# storage state (cookies readable from JS + localStorage) and restore it before the first navigation
+# to that site. This is what carries consent choices and session cookies from one task to the next.
+PROFILE_DIR = os.getenv("PROFILE_DIR", ".profiles")
+PROFILE_MAX_BYTES = int(os.getenv("PROFILE_MAX_BYTES", str(50 * 1024 * 1024)))  # per tenant
+PROFILE_COOKIE_MAX_AGE = 30 * 24 * 3600
+
+TENANT_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+CAPTURE_STATE_JS = """JSON.stringify({
+  origin: location.origin,
+  cookies: document.cookie,
+  localStorage: Object.fromEntries(Object.keys(localStorage).map(k => [k, localStorage.getItem(k)]))
+})"""
+
+# Resources served from the browser cache report a transferSize of 0 but a non-zero body
+RESOURCE_STATS_JS = """JSON.stringify((() => {
+  const entries = performance.getEntriesByType('resource');
+  return {total: entries.length, cached: entries.filter(e => e.transferSize === 0 && e.decodedBodySize > 0).length};
+})())"""
+
+# tenant -> site -> counters, see get_stats()
+site_stats: Dict[str, Dict[str, dict]] = {}
+
+
+def site_key(url: str) -> Optional[str]:
+    host = urlparse(url if "://" in url else f"https://{url}").hostname
+    if not host:
+        return None
+    return host[4:] if host.startswith("www.") else host
+
+
+def _site_dir(tenant: str, site: str) -> str:
+    return os.path.join(PROFILE_DIR, tenant, site)
+
+
+def load_state(tenant: str, site: str) -> Optional[dict]:
+    """Read without locking, writers replace the file atomically."""
+    path = os.path.join(_site_dir(tenant, site), "state.json")
+    try:
+        with open(path) as f:
+            state = json.load(f)
+        os.utime(path)  # last use, for LRU eviction
+        return state
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def _site_lock(site_dir: str):
+    """Exclusive lock on one site profile. Eviction may remove the directory while we wait, in which
+    case the lock we got is on a deleted file: recreate the directory and lock again."""
+    lock_path = os.path.join(site_dir, ".lock")
+    while True:
+        try:
+            os.makedirs(site_dir, exist_ok=True)
+            lock = open(lock_path, "a")
+        except (FileExistsError, FileNotFoundError):
+            continue
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.fstat(lock.fileno()).st_ino == os.stat(lock_path).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        lock.close()
+    try:
+        yield
+    finally:
+        lock.close()
+
+
+def save_state(tenant: str, site: str, state: dict):
+    """Merge into the stored state under an exclusive lock, so concurrent browsers on the same
+    site add to the profile instead of overwriting each other."""
+    site_dir = _site_dir(tenant, site)
+    with _site_lock(site_dir):
+        current = load_state(tenant, site) or {"cookies": {}, "localStorage": {}}
+        current["origin"] = state["origin"]
+        current["cookies"].update(state["cookies"])
+        current["localStorage"].update(state["localStorage"])
+        current["updated_at"] = time.time()
+
+        tmp_path = os.path.join(site_dir, "state.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(current, f)
+        os.replace(tmp_path, os.path.join(site_dir, "state.json"))
+    evict(tenant)
+
+
+def _profile_size(site_dir: str) -> Optional[tuple]:
+    """(last used, bytes) of a site profile, None if it was removed meanwhile."""
+    try:
+        size = sum(os.path.getsize(os.path.join(site_dir, f)) for f in os.listdir(site_dir))
+    except OSError:
+        return None
+    try:
+        last_used = os.path.getmtime(os.path.join(site_dir, "state.json"))
+    except OSError:
+        last_used = 0
+    return last_used, size
+
+
+def evict(tenant: str):
+    """Drop the tenant's least recently used site profiles until they fit in PROFILE_MAX_BYTES.
+    Each tenant has its own budget, so a heavy tenant can't push out everyone else's profiles."""
+    tenant_dir = os.path.join(PROFILE_DIR, tenant)
+    os.makedirs(tenant_dir, exist_ok=True)
+
+    # One eviction pass per tenant at a time, across threads and worker processes
+    with open(os.path.join(tenant_dir, ".evict.lock"), "a") as evict_lock:
+        fcntl.flock(evict_lock, fcntl.LOCK_EX)
+
+        profiles = []
+        total = 0
+        for site in os.listdir(tenant_dir):
+            site_dir = os.path.join(tenant_dir, site)
+            if not os.path.isdir(site_dir):
+                continue
+            usage = _profile_size(site_dir)
+            if usage is None:
+                continue
+            profiles.append((usage[0], usage[1], site_dir))
+            total += usage[1]
+
+        for last_used, size, site_dir in sorted(profiles):
+            if total <= PROFILE_MAX_BYTES:
+                break
+            # Take the site lock so a writer is never mid-save in the directory being removed
+            try:
+                lock = open(os.path.join(site_dir, ".lock"), "a")
+            except FileNotFoundError:
+                continue
+            with lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                shutil.rmtree(site_dir, ignore_errors=True)
+            total -= size
+
+
+def _parse_cookies(cookie_str: str) -> Dict[str, str]:
+    cookies = {}
+    for part in cookie_str.split(";"):
+        if "=" in part:
+            name, value = part.split("=", 1)
+            cookies[name.strip()] = value.strip()
+    return cookies
+
+
+def _restore_script(state: dict) -> str:
+    cookies = [f"{name}={value}; path=/; max-age={PROFILE_COOKIE_MAX_AGE}" for name, value in state["cookies"].items()]
+    return f"""(() => {{
+  {json.dumps(cookies)}.forEach(c => {{ document.cookie = c; }});
+  Object.entries({json.dumps(state["localStorage"])}).forEach(([k, v]) => {{ try {{ localStorage.setItem(k, v); }} catch (e) {{}} }});
+  return 'restored';
+}})()"""
+
+
+async def _evaluate_json(session, script: str):
+    value = evaluate_value(tool_result_text(await session.call_tool("playwright_evaluate", arguments={"script": script})))
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def _stats(tenant: str, site: str) -> dict:
+    return site_stats.setdefault(tenant, {}).setdefault(site, {
+        "navigations": 0,
+        "profile_hits": 0,
+        "nav_ms_with_profile": 0.0,
+        "nav_ms_without_profile": 0.0,
+        "restores": 0,
+        "restore_ms": 0.0,
+        "resources": 0,
+        "resources_from_cache": 0
+    })
+
+
+def get_stats(tenant: str) -> Dict[str, dict]:
+    """Per-site profile hit ratio, browser cache hit ratio and navigation time with vs without a profile."""
+    report = {}
+    for site, s in site_stats.get(tenant, {}).items():
+        hits = s["profile_hits"]
+        misses = s["navigations"] - hits
+        # The robots.txt navigation + restore is paid to get the profile, so it counts towards its navigations
+        with_profile = (s["nav_ms_with_profile"] + s["restore_ms"]) / hits if hits else None
+        without_profile = s["nav_ms_without_profile"] / misses if misses else None
+        report[site] = {
+            "navigations": s["navigations"],
+            "profile_hits": hits,
+            "profile_hit_ratio": round(hits / s["navigations"], 3) if s["navigations"] else None,
+            "cache_hit_ratio": round(s["resources_from_cache"] / s["resources"], 3) if s["resources"] else None,
+            "avg_nav_ms_with_profile": round(with_profile, 1) if with_profile is not None else None,
+            "avg_nav_ms_without_profile": round(without_profile, 1) if without_profile is not None else None,
+            "avg_restore_ms": round(s["restore_ms"] / s["restores"], 1) if s["restores"] else None,
+            "nav_time_improvement_pct": round((1 - with_profile / without_profile) * 100, 1)
+                                        if with_profile is not None and without_profile else None
+        }
+    return report
+
+
+class ProfileSession:
+    """Profile bookkeeping for one run_agent session: restores each site once, measures
+    navigations and saves the state of the page the session ends on."""
+
+    def __init__(self, tenant: str = "default", log_callback: Optional[callable] = None):
+        if not TENANT_RE.match(tenant):
+            raise ValueError(f"Invalid tenant name: {tenant}")
+        self.tenant = tenant
+        self.log_callback = log_callback
+        self.restored: Dict[str, bool] = {}
+        self.current_site: Optional[str] = None
+
+    def _log(self, message: str):
+        if self.log_callback:
+            self.log_callback(message, "warning")
+
+    async def before_navigate(self, session, url: str):
+        """Profile bookkeeping never raises, a failure here must not stop the navigation itself."""
+        site = site_key(url)
+        # Leaving a site, keep what it stored before the page is gone
+        if self.current_site and site != self.current_site:
+            await self.save(session)
+        if not site or site in self.restored:
+            return
+        state = load_state(self.tenant, site)
+        self.restored[site] = False
+        if not state:
+            return
+
+        # Cookies and localStorage can only be set from a page on the same origin, robots.txt is the
+        # cheapest one to load before the real navigation
+        start = time.perf_counter()
+        try:
+            result = await session.call_tool("playwright_navigate", arguments={"url": state["origin"] + "/robots.txt"})
+            if not is_failed_result(tool_result_text(result)):
+                result = await session.call_tool("playwright_evaluate", arguments={"script": _restore_script(state)})
+                self.restored[site] = not is_failed_result(tool_result_text(result))
+        except Exception as e:
+            self._log(f"Profile restore for {site} failed: {str(e)[:100]}")
+        if self.restored[site]:
+            stats = _stats(self.tenant, site)
+            stats["restores"] += 1
+            stats["restore_ms"] += (time.perf_counter() - start) * 1000
+
+    async def after_navigate(self, session, url: str, nav_seconds: float):
+        site = site_key(url)
+        self.current_site = site
+        if not site:
+            return
+        stats = _stats(self.tenant, site)
+        stats["navigations"] += 1
+        if self.restored.get(site):
+            stats["profile_hits"] += 1
+            stats["nav_ms_with_profile"] += nav_seconds * 1000
+        else:
+            stats["nav_ms_without_profile"] += nav_seconds * 1000
+
+        try:
+            rstats = await _evaluate_json(session, RESOURCE_STATS_JS)
+            stats["resources"] += rstats["total"]
+            stats["resources_from_cache"] += rstats["cached"]
+        except Exception:
+            pass
+
+    async def save(self, session):
+        try:
+            state = await _evaluate_json(session, CAPTURE_STATE_JS)
+        except Exception:
+            return
+        origin = state.get("origin", "") if isinstance(state, dict) else ""
+        if not origin.startswith("http"):
+            return
+        # The lock may be held by another worker's browser, don't block the event loop on it
+        try:
+            await asyncio.to_thread(save_state, self.tenant, site_key(origin), {
+                "origin": origin,
+                "cookies": _parse_cookies(state.get("cookies", "")),
+                "localStorage": state.get("localStorage", {})
+            })
+        except Exception as e:
+            self._log(f"Profile save for {site_key(origin)} failed: {str(e)[:100]}")
@@ -287,3 +287,35 @@ Step 6: FINAL_ANSWER: The price is $1,299.00
 ═══════════════════════════════════════════════════════════
 
 Now return ONLY your next tool call or final answer."""
+
+SYSTEM_PROMPT_PLANNER = """You are a planner for a web automation agent. Decide whether a GOAL can be split into INDEPENDENT sub-goals that separate browsers can work on at the same time.
+
+═══════════════════════════════════════════════════════════
+RULES
+═══════════════════════════════════════════════════════════
+
+1. Split ONLY when the goal covers several websites or several items that don't depend on each other
+   (e.g. comparing a price on Amazon, Best Buy and Walmart → one sub-goal per site)
+2. Every sub-goal must be self-contained: name the website and the exact thing to find
+3. Never split steps that depend on each other (search → click → extract stays ONE goal)
+4. Use at most 5 sub-goals
+5. If the goal should NOT be split, return exactly: SINGLE
+
+═══════════════════════════════════════════════════════════
+RESPONSE FORMAT
+═══════════════════════════════════════════════════════════
+
+SUBGOAL: Go to amazon.com and find the price of the iPhone 15
+SUBGOAL: Go to bestbuy.com and find the price of the iPhone 15
+SUBGOAL: Go to walmart.com and find the price of the iPhone 15
+
+Return ONLY SUBGOAL lines or SINGLE."""
+
+SYSTEM_PROMPT_MERGE = """You combine the partial results of sub-goals into one answer for the original GOAL.
+
+1. Use ONLY the data in the partial results, never invent values
+2. If a sub-goal failed, say that its data is unavailable
+3. Answer the GOAL directly (for comparisons, state which option is best and list all values)
+
+Return exactly one line:
+FINAL_ANSWER: <combined answer>"""
@@ -0,0 +1,114 @@
+import argparse
+import json
+import sys
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# Per-task execution timeline exported in Chrome Trace Event format, which Perfetto and
+# chrome://tracing both load. Timestamps are wall-clock microseconds so traces from different
+# tasks line up when merged.
+_EPOCH = time.time() - time.perf_counter()
+
+
+def _now_us() -> int:
+    return int((_EPOCH + time.perf_counter()) * 1_000_000)
+
+
+class Tracer:
+    """Records nested spans for one task. Spans are closed innermost-first, so an early
+    `continue`/`return` in the agent loop can't leave the timeline badly nested."""
+
+    def __init__(self, name: str = "task"):
+        self.name = name
+        self.events: List[Dict] = []
+        self._stack: List[tuple] = []
+
+    def begin(self, name: str, cat: str = "agent", **args):
+        self._stack.append((name, cat, _now_us(), args))
+
+    def end(self, name: Optional[str] = None):
+        """Close the span `name` (and anything still open inside it), or the innermost span."""
+        if name is not None and name not in [s[0] for s in self._stack]:
+            return
+        while self._stack:
+            span_name, cat, ts, args = self._stack.pop()
+            self.events.append({"name": span_name, "cat": cat, "ph": "X", "ts": ts, "dur": _now_us() - ts, "args": args})
+            if name is None or span_name == name:
+                break
+
+    @contextmanager
+    def span(self, name: str, cat: str = "agent", **args):
+        self.begin(name, cat, **args)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def instant(self, name: str, cat: str = "agent", **args):
+        self.events.append({"name": name, "cat": cat, "ph": "i", "s": "t", "ts": _now_us(), "args": args})
+
+    def close(self):
+        while self._stack:
+            self.end()
+
+    def to_chrome(self, pid: int = 1, tid: int = 1) -> dict:
+        # Spans still open (task in progress) are exported up to now
+        open_events = [
+            {"name": n, "cat": c, "ph": "X", "ts": ts, "dur": _now_us() - ts, "args": {**args, "open": True}}
+            for n, c, ts, args in self._stack
+        ]
+        events = [
+            {"name": "process_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": self.name}},
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": self.name}}
+        ]
+        events += [{**e, "pid": pid, "tid": tid} for e in self.events + open_events]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def merge_traces(traces: List[dict]) -> dict:
+    """Put each task on its own process track so overlapping tasks show up side by side."""
+    events = []
+    for idx, trace in enumerate(traces):
+        events += [{**e, "pid": idx + 1} for e in trace.get("traceEvents", [])]
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def _fetch_json(url: str) -> dict:
+    with urllib.request.urlopen(url) as resp:
+        return json.loads(resp.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge task traces into one Chrome/Perfetto trace file")
+    parser.add_argument("files", nargs="*", help="Trace JSON files exported from GET /task/{task_id}/trace")
+    parser.add_argument("--api", help="Fetch traces of all tasks from a running server, e.g. http://localhost:8000")
+    parser.add_argument("--status", help="Only tasks with this status (with --api)")
+    parser.add_argument("-o", "--output", default="merged_trace.json")
+    opts = parser.parse_args()
+
+    traces = []
+    for path in opts.files:
+        with open(path) as f:
+            traces.append(json.load(f))
+
+    if opts.api:
+        base = opts.api.rstrip("/")
+        listing = _fetch_json(f"{base}/tasks?limit=100000" + (f"&status={opts.status}" if opts.status else ""))
+        for task in listing["tasks"]:
+            try:
+                traces.append(_fetch_json(f"{base}/task/{task['task_id']}/trace"))
+            except Exception as e:
+                print(f"Skipping {task['task_id']}: {e}", file=sys.stderr)
+
+    if not traces:
+        parser.error("no traces given, pass trace files or --api")
+
+    with open(opts.output, "w") as f:
+        json.dump(merge_traces(traces), f)
+    print(f"Merged {len(traces)} traces into {opts.output}")
+
+
+if __name__ == "__main__":
+    main()